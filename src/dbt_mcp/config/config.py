@@ -5,6 +5,13 @@ from pathlib import Path
 import yaml
 from dotenv import load_dotenv
 
+# Prefer the libyaml-backed loader, falling back
+# to the pure-Python one when it isn't available.
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader  # type: ignore[assignment]
+
 
 @dataclass
 class TrackingConfig:
@@ -37,6 +44,7 @@ class DbtCliConfig:
     project_dir: str
     dbt_path: str
     dbt_cli_timeout: int
+    dbt_cli_max_concurrency: int
 
 
 @dataclass
@@ -77,6 +85,9 @@ def load_config() -> Config:
     disable_remote = os.environ.get("DISABLE_REMOTE", "true") == "true"
     multicell_account_prefix = os.environ.get("MULTICELL_ACCOUNT_PREFIX", None)
     dbt_cli_timeout = int(os.environ.get("DBT_CLI_TIMEOUT", 10))
+    dbt_cli_max_concurrency = int(
+        os.environ.get("DBT_CLI_MAX_CONCURRENCY", max(1, (os.cpu_count() or 2) // 2))
+    )
     disable_tools = os.environ.get("DISABLE_TOOLS", "").split(",")
 
     # set default warn error options if not provided
@@ -128,6 +139,8 @@ def load_config() -> Config:
             errors.append(
                 "DBT_PATH environment variable is required when dbt CLI tools are enabled."
             )
+        if dbt_cli_max_concurrency < 1:
+            errors.append("DBT_CLI_MAX_CONCURRENCY must be at least 1.")
 
     if errors:
         raise ValueError("Errors found in configuration:\n\n" + "\n".join(errors))
@@ -165,6 +178,7 @@ def load_config() -> Config:
             project_dir=project_dir,
             dbt_path=dbt_path,
             dbt_cli_timeout=dbt_cli_timeout,
+            dbt_cli_max_concurrency=dbt_cli_max_concurrency,
         )
 
     discovery_config = None
@@ -214,8 +228,8 @@ def load_config() -> Config:
         home = os.environ.get("HOME")
         user_path = Path(f"{home}/.dbt/.user.yml")
         if home and user_path.exists():
-            with open(user_path) as f:
-                local_user_id = yaml.safe_load(f).get("id")
+            with open(user_path, "rb") as f:
+                local_user_id = yaml.load(f, Loader=SafeLoader).get("id")
     except Exception:
         pass
 
@@ -1,5 +1,10 @@
+import asyncio
+import contextlib
 import os
-import subprocess
+import re
+import shlex
+import signal
+from collections import deque
 from collections.abc import Iterable, Sequence
 
 from mcp.server.fastmcp import FastMCP
@@ -7,61 +12,159 @@ from pydantic import Field
 
 from dbt_mcp.config.config import DbtCliConfig
 from dbt_mcp.prompts.prompts import get_prompt
+from dbt_mcp.tools.definitions import ToolDefinition
+from dbt_mcp.tools.register import register_tools
 
+# dbt can write a lot of output, so read it in large chunks
+STREAM_READ_SIZE = 1 << 16
+# Seconds to wait for a killed dbt process to be reaped
+PROCESS_REAP_TIMEOUT = 1
+# Only the tail of the output is returned for commands that just
+# log. That's where dbt reports results and errors, and it keeps
+# memory bounded.
+MAX_OUTPUT_LINES = 2048
+# The output of show and list is the data itself, so they aren't
+# in here and always return their full output.
+TAIL_OUTPUT_COMMANDS = frozenset(
+    {
+        "build",
+        "compile",
+        "docs",
+        "parse",
+        "run",
+        "test",
+    }
+)
 
-def register_dbt_cli_tools(
-    dbt_mcp: FastMCP,
-    config: DbtCliConfig,
-    exclude_tools: Sequence[str] = [],
-) -> None:
-    def _run_dbt_command(
+# Commands that should always be quiet to reduce output verbosity
+VERBOSE_COMMANDS = frozenset(
+    {
+        "build",
+        "compile",
+        "docs",
+        "parse",
+        "run",
+        "test",
+        "list",
+    }
+)
+
+# Matches a LIMIT keyword without lowercasing the whole query
+LIMIT_PATTERN = re.compile(r"\blimit\b", re.IGNORECASE)
+
+
+def _kill_process_group(process: asyncio.subprocess.Process) -> None:
+    # DBT_PATH can be a wrapper whose children keep the output
+    # pipe open, so kill the whole process group where we can
+    if hasattr(os, "killpg"):
+        with contextlib.suppress(ProcessLookupError, PermissionError):
+            os.killpg(process.pid, signal.SIGKILL)
+    else:
+        process.kill()
+
+
+def create_dbt_cli_tool_definitions(config: DbtCliConfig) -> list[ToolDefinition]:
+    # Cap how many dbt processes can run at once. Waiters
+    # are let through in the order they arrived.
+    dbt_semaphore = asyncio.Semaphore(config.dbt_cli_max_concurrency)
+
+    async def _run_dbt_command(
         command: list[str],
         selector: str | None = None,
         timeout: int | None = None,
         resource_type: list[str] | None = None,
         is_selectable: bool = False,
     ) -> str:
+        slot_acquired = False
         try:
-            # Commands that should always be quiet to reduce output verbosity
-            verbose_commands = [
-                "build",
-                "compile",
-                "docs",
-                "parse",
-                "run",
-                "test",
-                "list",
-            ]
-
-            if selector:
-                selector_params = str(selector).split(" ")
-                command = command + ["--select"] + selector_params
+            main_command = command[0]
+            args = [config.dbt_path, main_command]
+            # Add --quiet flag to specific commands to reduce context window usage
+            if main_command in VERBOSE_COMMANDS:
+                args.append("--quiet")
+            args.extend(command[1:])
 
-            if isinstance(resource_type, Iterable):
-                command = command + ["--resource-type"] + resource_type
+            if isinstance(selector, str) and selector:
+                # Selectors can be quoted, so only tokenize when needed
+                if " " in selector or '"' in selector or "'" in selector:
+                    # Backslashes are kept as is, since they can be
+                    # part of Windows paths in path: selectors
+                    lexer = shlex.shlex(selector, posix=True)
+                    lexer.whitespace_split = True
+                    lexer.escape = ""
+                    try:
+                        selectors = list(lexer)
+                    except ValueError as e:
+                        raise ValueError(f"Invalid selector quoting: {e}") from e
+                else:
+                    selectors = [selector]
+                # A blank selector selects nothing, so leave out --select
+                if selectors:
+                    args.extend(("--select", *selectors))
 
-            full_command = command.copy()
-            # Add --quiet flag to specific commands to reduce context window usage
-            if len(full_command) > 0 and full_command[0] in verbose_commands:
-                main_command = full_command[0]
-                command_args = full_command[1:] if len(full_command) > 1 else []
-                full_command = [main_command, "--quiet", *command_args]
+            if isinstance(resource_type, Iterable):
+                args.extend(("--resource-type", *resource_type))
 
             # We change the path only if this is an absolute path, otherwise we can have
             # problems with relative paths applied multiple times as DBT_PROJECT_DIR
             # is applied to dbt Core and Fusion as well (but not the dbt Cloud CLI)
             cwd_path = config.project_dir if os.path.isabs(config.project_dir) else None
 
-            process = subprocess.Popen(
-                args=[config.dbt_path, *full_command],
-                cwd=cwd_path,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
+            output_lines: deque[bytes] = deque(
+                maxlen=MAX_OUTPUT_LINES
+                if main_command in TAIL_OUTPUT_COMMANDS
+                else None
             )
-            output, _ = process.communicate(timeout=timeout)
+            line_count = 0
+            # Lines are split here rather than with readline,
+            # which fails on lines longer than its buffer limit
+            pending = bytearray()
+            # The timeout also covers waiting for a free slot, so a
+            # command can't queue forever behind a long build
+            async with asyncio.timeout(timeout), dbt_semaphore:
+                slot_acquired = True
+                process = await asyncio.create_subprocess_exec(
+                    *args,
+                    cwd=cwd_path,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.STDOUT,
+                    start_new_session=True,
+                )
+                try:
+                    assert process.stdout is not None
+                    while chunk := await process.stdout.read(STREAM_READ_SIZE):
+                        start = 0
+                        while (end := chunk.find(b"\n", start)) != -1:
+                            pending += chunk[start : end + 1]
+                            output_lines.append(bytes(pending))
+                            line_count += 1
+                            pending.clear()
+                            start = end + 1
+                        pending += chunk[start:]
+                    await process.wait()
+                finally:
+                    # Don't leave dbt running in the background
+                    if process.returncode is None:
+                        _kill_process_group(process)
+                        # A child that left the group can still hold the
+                        # pipe open, which would block wait() until it exits
+                        with contextlib.suppress(TimeoutError):
+                            await asyncio.wait_for(process.wait(), PROCESS_REAP_TIMEOUT)
+            if pending:
+                output_lines.append(bytes(pending))
+                line_count += 1
+
+            output = b"".join(output_lines).decode("utf-8", errors="replace")
+            omitted_lines = line_count - len(output_lines)
+            if omitted_lines:
+                output = f"[{omitted_lines} earlier lines omitted]\n" + output
             return output or "OK"
-        except subprocess.TimeoutExpired:
+        except TimeoutError:
+            if not slot_acquired:
+                return (
+                    "Timeout: waiting for another dbt command to finish."
+                    " Try again once it has completed."
+                )
             return "Timeout: dbt command took too long to complete." + (
                 " Try using a specific selector to narrow down the results."
                 if is_selectable
@@ -70,24 +173,20 @@ def register_dbt_cli_tools(
         except Exception as e:
             return str(e)
 
-    @dbt_mcp.tool(description=get_prompt("dbt_cli/build"))
-    def build(
+    async def build(
         selector: str | None = Field(
             default=None, description=get_prompt("dbt_cli/args/selectors")
         ),
     ) -> str:
-        return _run_dbt_command(["build"], selector, is_selectable=True)
+        return await _run_dbt_command(["build"], selector, is_selectable=True)
 
-    @dbt_mcp.tool(description=get_prompt("dbt_cli/compile"))
-    def compile() -> str:
-        return _run_dbt_command(["compile"])
+    async def compile() -> str:
+        return await _run_dbt_command(["compile"])
 
-    @dbt_mcp.tool(description=get_prompt("dbt_cli/docs"))
-    def docs() -> str:
-        return _run_dbt_command(["docs", "generate"])
+    async def docs() -> str:
+        return await _run_dbt_command(["docs", "generate"])
 
-    @dbt_mcp.tool(name="list", description=get_prompt("dbt_cli/list"))
-    def ls(
+    async def ls(
         selector: str | None = Field(
             default=None, description=get_prompt("dbt_cli/args/selectors")
         ),
@@ -96,7 +195,7 @@ def register_dbt_cli_tools(
             description=get_prompt("dbt_cli/args/resource_type"),
         ),
     ) -> str:
-        return _run_dbt_command(
+        return await _run_dbt_command(
             ["list"],
             selector,
             timeout=config.dbt_cli_timeout,
@@ -104,28 +203,24 @@ def register_dbt_cli_tools(
             is_selectable=True,
         )
 
-    @dbt_mcp.tool(description=get_prompt("dbt_cli/parse"))
-    def parse() -> str:
-        return _run_dbt_command(["parse"])
+    async def parse() -> str:
+        return await _run_dbt_command(["parse"])
 
-    @dbt_mcp.tool(description=get_prompt("dbt_cli/run"))
-    def run(
+    async def run(
         selector: str | None = Field(
             default=None, description=get_prompt("dbt_cli/args/selectors")
         ),
     ) -> str:
-        return _run_dbt_command(["run"], selector, is_selectable=True)
+        return await _run_dbt_command(["run"], selector, is_selectable=True)
 
-    @dbt_mcp.tool(description=get_prompt("dbt_cli/test"))
-    def test(
+    async def test(
         selector: str | None = Field(
             default=None, description=get_prompt("dbt_cli/args/selectors")
         ),
     ) -> str:
-        return _run_dbt_command(["test"], selector, is_selectable=True)
+        return await _run_dbt_command(["test"], selector, is_selectable=True)
 
-    @dbt_mcp.tool(description=get_prompt("dbt_cli/show"))
-    def show(
+    async def show(
         sql_query: str = Field(description=get_prompt("dbt_cli/args/sql_query")),
         limit: int | None = Field(
             default=None, description=get_prompt("dbt_cli/args/limit")
@@ -135,7 +230,7 @@ def register_dbt_cli_tools(
         # This is quite crude, but it should be okay for now
         # until we have a dbt Fusion integration.
         cli_limit = None
-        if "limit" in sql_query.lower():
+        if LIMIT_PATTERN.search(sql_query):
             # When --limit=-1, dbt won't apply a separate limit.
             cli_limit = -1
         elif limit:
@@ -147,4 +242,62 @@ def register_dbt_cli_tools(
         if cli_limit is not None:
             args.extend(["--limit", str(cli_limit)])
         args.extend(["--output", "json"])
-        return _run_dbt_command(args)
+        return await _run_dbt_command(args)
+
+    # These tools were registered with FastMCP's default structured
+    # output before moving to tool definitions, so keep it that way
+    return [
+        ToolDefinition(
+            description=get_prompt("dbt_cli/build"),
+            fn=build,
+            structured_output=None,
+        ),
+        ToolDefinition(
+            description=get_prompt("dbt_cli/compile"),
+            fn=compile,
+            structured_output=None,
+        ),
+        ToolDefinition(
+            description=get_prompt("dbt_cli/docs"),
+            fn=docs,
+            structured_output=None,
+        ),
+        ToolDefinition(
+            name="list",
+            description=get_prompt("dbt_cli/list"),
+            fn=ls,
+            structured_output=None,
+        ),
+        ToolDefinition(
+            description=get_prompt("dbt_cli/parse"),
+            fn=parse,
+            structured_output=None,
+        ),
+        ToolDefinition(
+            description=get_prompt("dbt_cli/run"),
+            fn=run,
+            structured_output=None,
+        ),
+        ToolDefinition(
+            description=get_prompt("dbt_cli/test"),
+            fn=test,
+            structured_output=None,
+        ),
+        ToolDefinition(
+            description=get_prompt("dbt_cli/show"),
+            fn=show,
+            structured_output=None,
+        ),
+    ]
+
+
+def register_dbt_cli_tools(
+    dbt_mcp: FastMCP,
+    config: DbtCliConfig,
+    exclude_tools: Sequence[str] = [],
+) -> None:
+    register_tools(
+        dbt_mcp,
+        create_dbt_cli_tool_definitions(config),
+        exclude_tools,
+    )
@@ -1,5 +1,7 @@
+from functools import cache
 from pathlib import Path
 
 
+@cache
 def get_prompt(name: str) -> str:
     return (Path(__file__).parent / f"{name}.md").read_text()
@@ -29,6 +29,7 @@ mock_dbt_cli_config = DbtCliConfig(
     project_dir="/test/project",
     dbt_path="/path/to/dbt",
     dbt_cli_timeout=10,
+    dbt_cli_max_concurrency=4,
 )
 
 mock_discovery_config = DiscoveryConfig(
@@ -0,0 +1,28 @@
+class MockStream:
+    def __init__(self, chunks: list[bytes]):
+        self._chunks = iter(chunks)
+
+    async def read(self, n=-1):
+        return next(self._chunks, b"")
+
+
+class MockProcess:
+    def __init__(self, output_chunks: list[bytes]):
+        self.stdout = MockStream(output_chunks)
+        self.returncode = None
+
+    async def wait(self):
+        self.returncode = 0
+        return 0
+
+
+class SubprocessStub:
+    """Stands in for asyncio.create_subprocess_exec and records each call."""
+
+    def __init__(self, process):
+        self.process = process
+        self.calls = []
+
+    async def __call__(self, *args, **kwargs):
+        self.calls.append((list(args), kwargs))
+        return self.process
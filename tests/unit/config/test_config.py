@@ -0,0 +1,25 @@
+import pytest
+from pytest import MonkeyPatch
+
+from dbt_mcp.config import config as config_module
+from dbt_mcp.config.config import load_config
+
+
+@pytest.mark.parametrize("max_concurrency", ["0", "-1"])
+def test_load_config_rejects_max_concurrency_below_one(
+    monkeypatch: MonkeyPatch, max_concurrency: str
+):
+    # Keep a local .env out of the test, and let monkeypatch
+    # restore the warn error options load_config sets
+    monkeypatch.setattr(config_module, "load_dotenv", lambda: None)
+    monkeypatch.delenv("DBT_WARN_ERROR_OPTIONS", raising=False)
+    monkeypatch.setenv("DISABLE_DBT_CLI", "false")
+    monkeypatch.setenv("DISABLE_SEMANTIC_LAYER", "true")
+    monkeypatch.setenv("DISABLE_DISCOVERY", "true")
+    monkeypatch.setenv("DISABLE_REMOTE", "true")
+    monkeypatch.setenv("DBT_PROJECT_DIR", "/test/project")
+    monkeypatch.setenv("DBT_PATH", "/path/to/dbt")
+    monkeypatch.setenv("DBT_CLI_MAX_CONCURRENCY", max_concurrency)
+
+    with pytest.raises(ValueError, match="DBT_CLI_MAX_CONCURRENCY must be at least 1"):
+        load_config()
@@ -0,0 +1,30 @@
+import asyncio
+
+import pytest
+from pytest import MonkeyPatch
+
+from tests.mocks.process import MockProcess, SubprocessStub
+
+
+@pytest.fixture
+def subprocess_stub(monkeypatch: MonkeyPatch):
+    stub = SubprocessStub(MockProcess([b"command output"]))
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", stub)
+    return stub
+
+
+@pytest.fixture
+def mock_fastmcp():
+    class MockFastMCP:
+        def __init__(self):
+            self.tools = {}
+
+        def tool(self, **kwargs):
+            def decorator(func):
+                self.tools[func.__name__] = func
+                return func
+
+            return decorator
+
+    fastmcp = MockFastMCP()
+    return fastmcp, fastmcp.tools
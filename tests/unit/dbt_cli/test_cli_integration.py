@@ -1,115 +1,49 @@
-import unittest
-from unittest.mock import MagicMock, patch
-
-from tests.mocks.config import mock_config
-
-
-class TestDbtCliIntegration(unittest.TestCase):
-    @patch("subprocess.Popen")
-    def test_dbt_command_execution(self, mock_popen):
-        """
-        Tests the full execution path for dbt commands, ensuring they are properly
-        executed with the right arguments.
-        """
-        # Import here to prevent circular import issues during patching
-        from dbt_mcp.dbt_cli.tools import register_dbt_cli_tools
-
-        # Mock setup
-        mock_process = MagicMock()
-        mock_process.communicate.return_value = ("command output", None)
-        mock_popen.return_value = mock_process
-
-        # Create a mock FastMCP and Config
-        mock_fastmcp = MagicMock()
-
-        # Patch the tool decorator to capture functions
-        tools = {}
-
-        def mock_tool_decorator(**kwargs):
-            def decorator(func):
-                tools[func.__name__] = func
-                return func
-
-            return decorator
-
-        mock_fastmcp.tool = mock_tool_decorator
-
-        # Register the tools
-        register_dbt_cli_tools(mock_fastmcp, mock_config.dbt_cli_config)
-
-        # Test cases for different command types
-        test_cases = [
-            # Command name, args, expected command list
-            ("build", [], ["/path/to/dbt", "build", "--quiet"]),
-            (
-                "compile",
-                [],
-                ["/path/to/dbt", "compile", "--quiet"],
-            ),
-            (
-                "docs",
-                [],
-                ["/path/to/dbt", "docs", "--quiet", "generate"],
-            ),
-            (
-                "ls",
-                [],
-                ["/path/to/dbt", "list", "--quiet"],
-            ),
-            ("parse", [], ["/path/to/dbt", "parse", "--quiet"]),
-            ("run", [], ["/path/to/dbt", "run", "--quiet"]),
-            ("test", [], ["/path/to/dbt", "test", "--quiet"]),
-            (
-                "show",
-                ["SELECT * FROM model"],
-                [
-                    "/path/to/dbt",
-                    "show",
-                    "--inline",
-                    "SELECT * FROM model",
-                    "--favor-state",
-                    "--output",
-                    "json",
-                ],
-            ),
-            (
-                "show",
-                ["SELECT * FROM model", 10],
-                [
-                    "/path/to/dbt",
-                    "show",
-                    "--inline",
-                    "SELECT * FROM model",
-                    "--favor-state",
-                    "--limit",
-                    "10",
-                    "--output",
-                    "json",
-                ],
-            ),
-        ]
-
-        # Run each test case
-        for command_name, args, expected_args in test_cases:
-            mock_popen.reset_mock()
-
-            # Call the function
-            result = tools[command_name](*args)
-
-            # Verify the command was called correctly
-            mock_popen.assert_called_once()
-            actual_args = mock_popen.call_args.kwargs.get("args")
-
-            num_params = 3
-
-            self.assertEqual(actual_args[:num_params], expected_args[:num_params])
-
-            # Verify correct working directory
-            self.assertEqual(mock_popen.call_args.kwargs.get("cwd"), "/test/project")
-
-            # Verify the output is returned correctly
-            self.assertEqual(result, "command output")
-
-
-if __name__ == "__main__":
-    unittest.main()
+import pytest
+
+from dbt_mcp.dbt_cli.tools import register_dbt_cli_tools
+from tests.mocks.config import mock_dbt_cli_config
+
+
+@pytest.fixture
+def dbt_tools(mock_fastmcp):
+    fastmcp, tools = mock_fastmcp
+    register_dbt_cli_tools(fastmcp, mock_dbt_cli_config)
+    return tools
+
+
+@pytest.mark.parametrize(
+    "command_name,args,expected_command",
+    [
+        ("build", (), ("/path/to/dbt", "build")),
+        ("compile", (), ("/path/to/dbt", "compile")),
+        ("docs", (), ("/path/to/dbt", "docs")),
+        ("ls", (), ("/path/to/dbt", "list")),
+        ("parse", (), ("/path/to/dbt", "parse")),
+        ("run", (), ("/path/to/dbt", "run")),
+        ("test", (), ("/path/to/dbt", "test")),
+        ("show", ("SELECT * FROM model", None), ("/path/to/dbt", "show")),
+        ("show", ("SELECT * FROM model", 10), ("/path/to/dbt", "show")),
+    ],
+)
+@pytest.mark.asyncio
+async def test_dbt_command_execution(
+    dbt_tools, subprocess_stub, command_name, args, expected_command
+):
+    """
+    Tests the full execution path for dbt commands, ensuring they are properly
+    executed with the right arguments.
+    """
+    # Call the function
+    result = await dbt_tools[command_name](*args)
+
+    # Verify the command was called correctly, the full argv
+    # is covered by test_command_correctly_formatted
+    assert len(subprocess_stub.calls) == 1
+    actual_args, actual_kwargs = subprocess_stub.calls[-1]
+    assert tuple(actual_args[:2]) == expected_command
+
+    # Verify correct working directory
+    assert actual_kwargs.get("cwd") == "/test/project"
+
+    # Verify the output is returned correctly
+    assert result == "command output"
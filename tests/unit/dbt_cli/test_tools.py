@@ -1,36 +1,17 @@
-import subprocess
+import asyncio
+import json
+import os
+import signal
+from dataclasses import replace
 
 import pytest
+from mcp.server.fastmcp import FastMCP
 from pytest import MonkeyPatch
 
+from dbt_mcp.dbt_cli import tools as dbt_cli_tools
 from dbt_mcp.dbt_cli.tools import register_dbt_cli_tools
 from tests.mocks.config import mock_dbt_cli_config
-
-
-@pytest.fixture
-def mock_process():
-    class MockProcess:
-        def communicate(self, timeout=None):
-            return "command output", None
-
-    return MockProcess()
-
-
-@pytest.fixture
-def mock_fastmcp():
-    class MockFastMCP:
-        def __init__(self):
-            self.tools = {}
-
-        def tool(self, **kwargs):
-            def decorator(func):
-                self.tools[func.__name__] = func
-                return func
-
-            return decorator
-
-    fastmcp = MockFastMCP()
-    return fastmcp, fastmcp.tools
+from tests.mocks.process import MockProcess, SubprocessStub
 
 
 @pytest.mark.parametrize(
@@ -81,6 +62,21 @@ def mock_fastmcp():
                 "json",
             ],
         ),
+        # Column name containing "limit" - should use provided limit
+        (
+            "SELECT limits FROM my_model",
+            10,
+            [
+                "show",
+                "--inline",
+                "SELECT limits FROM my_model",
+                "--favor-state",
+                "--limit",
+                "10",
+                "--output",
+                "json",
+            ],
+        ),
         # No limits at all - should not include --limit flag
         (
             "SELECT * FROM my_model",
@@ -96,148 +92,366 @@ def mock_fastmcp():
         ),
     ],
 )
-def test_show_command_limit_logic(
-    monkeypatch: MonkeyPatch,
-    mock_process,
+@pytest.mark.asyncio
+async def test_show_command_limit_logic(
+    subprocess_stub,
     mock_fastmcp,
     sql_query,
     limit_param,
     expected_args,
 ):
-    # Mock Popen
-    mock_calls = []
-
-    def mock_popen(args, **kwargs):
-        mock_calls.append(args)
-        return mock_process
-
-    monkeypatch.setattr("subprocess.Popen", mock_popen)
-
     # Register tools and get show tool
     fastmcp, tools = mock_fastmcp
     register_dbt_cli_tools(fastmcp, mock_dbt_cli_config)
     show_tool = tools["show"]
 
     # Call show tool with test parameters
-    show_tool(sql_query=sql_query, limit=limit_param)
+    await show_tool(sql_query=sql_query, limit=limit_param)
 
     # Verify the command was called with expected arguments
-    assert mock_calls
-    args_list = mock_calls[0][1:]  # Skip the dbt path
+    assert subprocess_stub.calls
+    args_list = subprocess_stub.calls[0][0][1:]  # Skip the dbt path
     assert args_list == expected_args
 
 
-def test_run_command_adds_quiet_flag_to_verbose_commands(
-    monkeypatch: MonkeyPatch, mock_process, mock_fastmcp
+@pytest.mark.parametrize(
+    "tool_name,kwargs,expected_args",
+    [
+        # Verbose commands get the --quiet flag
+        ("build", {}, ["/path/to/dbt", "build", "--quiet"]),
+        ("compile", {}, ["/path/to/dbt", "compile", "--quiet"]),
+        ("docs", {}, ["/path/to/dbt", "docs", "--quiet", "generate"]),
+        ("ls", {}, ["/path/to/dbt", "list", "--quiet"]),
+        ("parse", {}, ["/path/to/dbt", "parse", "--quiet"]),
+        ("run", {}, ["/path/to/dbt", "run", "--quiet"]),
+        ("test", {}, ["/path/to/dbt", "test", "--quiet"]),
+        # Selectors are appended after the command
+        (
+            "run",
+            {"selector": "my_model"},
+            ["/path/to/dbt", "run", "--quiet", "--select", "my_model"],
+        ),
+        # Repeated spaces don't produce empty selector arguments
+        (
+            "run",
+            {"selector": "my_model  other_model"},
+            [
+                "/path/to/dbt",
+                "run",
+                "--quiet",
+                "--select",
+                "my_model",
+                "other_model",
+            ],
+        ),
+        # Quoted selectors are kept together
+        (
+            "run",
+            {"selector": '"tag:nightly daily" my_model'},
+            [
+                "/path/to/dbt",
+                "run",
+                "--quiet",
+                "--select",
+                "tag:nightly daily",
+                "my_model",
+            ],
+        ),
+        # A whitespace-only selector doesn't leave a bare --select
+        ("test", {"selector": "   "}, ["/path/to/dbt", "test", "--quiet"]),
+        # Backslashes in paths aren't treated as escapes
+        (
+            "run",
+            {"selector": "path:models\\marts other_model"},
+            [
+                "/path/to/dbt",
+                "run",
+                "--quiet",
+                "--select",
+                "path:models\\marts",
+                "other_model",
+            ],
+        ),
+        # show isn't quiet and always outputs JSON
+        (
+            "show",
+            {"sql_query": "SELECT * FROM my_model", "limit": None},
+            [
+                "/path/to/dbt",
+                "show",
+                "--inline",
+                "SELECT * FROM my_model",
+                "--favor-state",
+                "--output",
+                "json",
+            ],
+        ),
+    ],
+)
+@pytest.mark.asyncio
+async def test_command_correctly_formatted(
+    subprocess_stub,
+    mock_fastmcp,
+    tool_name,
+    kwargs,
+    expected_args,
 ):
-    # Mock Popen
-    mock_calls = []
+    # Setup
+    fastmcp, tools = mock_fastmcp
+    register_dbt_cli_tools(fastmcp, mock_dbt_cli_config)
+
+    # Execute
+    await tools[tool_name](**kwargs)
+
+    # Verify
+    assert subprocess_stub.calls
+    assert subprocess_stub.calls[-1][0] == expected_args
+
+
+@pytest.mark.asyncio
+async def test_unbalanced_selector_quote_rejected(subprocess_stub, mock_fastmcp):
+    fastmcp, tools = mock_fastmcp
+    register_dbt_cli_tools(fastmcp, mock_dbt_cli_config)
+
+    result = await tools["run"](selector='"tag:nightly my_model')
+
+    assert result == "Invalid selector quoting: No closing quotation"
+    assert not subprocess_stub.calls
+
 
-    def mock_popen(args, **kwargs):
-        mock_calls.append(args)
-        return mock_process
+@pytest.mark.asyncio
+async def test_list_command_timeout_handling(monkeypatch: MonkeyPatch, mock_fastmcp):
+    # Mock subprocess creation
+    killed = []
 
-    monkeypatch.setattr("subprocess.Popen", mock_popen)
+    class HangingStream:
+        async def read(self, n=-1):
+            # Hang like a stuck dbt process until the timeout hits
+            await asyncio.Event().wait()
+
+    class MockProcessWithTimeout:
+        pid = 4242
+
+        def __init__(self):
+            self.stdout = HangingStream()
+            self.returncode = None
+
+        async def wait(self):
+            return self.returncode
+
+    async def mock_exec(*args, **kwargs):
+        return MockProcessWithTimeout()
+
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", mock_exec)
+    monkeypatch.setattr(os, "killpg", lambda pid, sig: killed.append((pid, sig)))
 
     # Setup
     mock_fastmcp_obj, tools = mock_fastmcp
-    register_dbt_cli_tools(mock_fastmcp_obj, mock_dbt_cli_config)
-    run_tool = tools["run"]
+    register_dbt_cli_tools(
+        mock_fastmcp_obj, replace(mock_dbt_cli_config, dbt_cli_timeout=0)
+    )
+    list_tool = tools["ls"]
 
-    # Execute
-    run_tool()
+    # Test timeout case
+    result = await list_tool(resource_type=["model", "snapshot"])
+    assert "Timeout: dbt command took too long to complete" in result
+    assert "Try using a specific selector to narrow down the results" in result
+    # The whole process group is killed, not just the direct child
+    assert killed == [(4242, signal.SIGKILL)]
 
-    # Verify
-    assert mock_calls
-    args_list = mock_calls[0]
-    assert "--quiet" in args_list
+    # Test with selector - should still timeout
+    result = await list_tool(selector="my_model", resource_type=["model"])
+    assert "Timeout: dbt command took too long to complete" in result
+    assert "Try using a specific selector to narrow down the results" in result
 
 
-def test_run_command_correctly_formatted(
-    monkeypatch: MonkeyPatch, mock_process, mock_fastmcp
+@pytest.mark.asyncio
+async def test_list_command_timeout_with_pipe_held_open(
+    monkeypatch: MonkeyPatch, mock_fastmcp
 ):
-    # Mock Popen
-    mock_calls = []
+    class HangingStream:
+        async def read(self, n=-1):
+            await asyncio.Event().wait()
 
-    def mock_popen(args, **kwargs):
-        mock_calls.append(args)
-        return mock_process
+    class MockWrappedProcess:
+        pid = 4242
 
-    monkeypatch.setattr("subprocess.Popen", mock_popen)
+        def __init__(self):
+            self.stdout = HangingStream()
+            self.returncode = None
+
+        async def wait(self):
+            # A grandchild keeps the pipe open, so wait() never returns
+            await asyncio.Event().wait()
+
+    async def mock_exec(*args, **kwargs):
+        return MockWrappedProcess()
+
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", mock_exec)
+    monkeypatch.setattr(os, "killpg", lambda pid, sig: None)
+    monkeypatch.setattr(dbt_cli_tools, "PROCESS_REAP_TIMEOUT", 0.01)
 
     fastmcp, tools = mock_fastmcp
+    register_dbt_cli_tools(fastmcp, replace(mock_dbt_cli_config, dbt_cli_timeout=0))
+
+    async with asyncio.timeout(5):
+        result = await tools["ls"]()
 
-    # Register the tools
+    assert "Timeout: dbt command took too long to complete" in result
+
+
+@pytest.mark.asyncio
+async def test_run_command_keeps_output_tail(monkeypatch: MonkeyPatch, mock_fastmcp):
+    monkeypatch.setattr(dbt_cli_tools, "MAX_OUTPUT_LINES", 2)
+
+    monkeypatch.setattr(
+        asyncio,
+        "create_subprocess_exec",
+        SubprocessStub(
+            MockProcess([b"line 1\n", b"line 2\n", b"line 3\n", b"line 4\n"])
+        ),
+    )
+
+    fastmcp, tools = mock_fastmcp
     register_dbt_cli_tools(fastmcp, mock_dbt_cli_config)
-    run_tool = tools["run"]
 
-    # Run the command with a selector
-    run_tool(selector="my_model")
+    result = await tools["run"]()
 
-    # Verify the command is correctly formatted
-    assert mock_calls
-    args_list = mock_calls[0]
-    assert args_list == [
-        "/path/to/dbt",
-        "run",
-        "--quiet",
-        "--select",
-        "my_model",
-    ]
+    assert result == "[2 earlier lines omitted]\nline 3\nline 4\n"
 
 
-def test_show_command_correctly_formatted(
-    monkeypatch: MonkeyPatch, mock_process, mock_fastmcp
+@pytest.mark.asyncio
+async def test_run_command_reads_long_and_split_lines(
+    monkeypatch: MonkeyPatch, mock_fastmcp
 ):
-    # Mock Popen
-    mock_calls = []
+    long_line = b"x" * (2 << 20) + b"\n"
 
-    def mock_popen(args, **kwargs):
-        mock_calls.append(args)
-        return mock_process
+    monkeypatch.setattr(
+        asyncio,
+        "create_subprocess_exec",
+        SubprocessStub(MockProcess([long_line, b"line 1\nli", b"ne 2\nline 3"])),
+    )
 
-    monkeypatch.setattr("subprocess.Popen", mock_popen)
+    fastmcp, tools = mock_fastmcp
+    register_dbt_cli_tools(fastmcp, mock_dbt_cli_config)
 
-    # Setup
-    mock_fastmcp_obj, tools = mock_fastmcp
-    register_dbt_cli_tools(mock_fastmcp_obj, mock_dbt_cli_config)
-    show_tool = tools["show"]
+    result = await tools["run"]()
 
-    # Execute
-    show_tool(sql_query="SELECT * FROM my_model")
+    assert result == (long_line + b"line 1\nline 2\nline 3").decode()
 
-    # Verify
-    assert mock_calls
-    args_list = mock_calls[0]
-    assert args_list[0].endswith("dbt")
-    assert args_list[1] == "show"
-    assert args_list[2] == "--inline"
-    assert args_list[3] == "SELECT * FROM my_model"
-    assert args_list[4] == "--favor-state"
 
+@pytest.mark.asyncio
+async def test_show_command_returns_full_output(monkeypatch: MonkeyPatch, mock_fastmcp):
+    monkeypatch.setattr(dbt_cli_tools, "MAX_OUTPUT_LINES", 2)
+    rows = [{"id": i, "name": f"row {i}"} for i in range(600)]
+    output = json.dumps({"show": rows}, indent=2).encode()
 
-def test_list_command_timeout_handling(monkeypatch: MonkeyPatch, mock_fastmcp):
-    # Mock Popen
-    class MockProcessWithTimeout:
-        def communicate(self, timeout=None):
-            raise subprocess.TimeoutExpired(cmd=["dbt", "list"], timeout=10)
+    monkeypatch.setattr(
+        asyncio,
+        "create_subprocess_exec",
+        SubprocessStub(MockProcess(output.splitlines(keepends=True))),
+    )
 
-    def mock_popen(*args, **kwargs):
-        return MockProcessWithTimeout()
+    fastmcp, tools = mock_fastmcp
+    register_dbt_cli_tools(fastmcp, mock_dbt_cli_config)
 
-    monkeypatch.setattr("subprocess.Popen", mock_popen)
+    result = await tools["show"](sql_query="SELECT * FROM my_model", limit=None)
 
-    # Setup
-    mock_fastmcp_obj, tools = mock_fastmcp
-    register_dbt_cli_tools(mock_fastmcp_obj, mock_dbt_cli_config)
-    list_tool = tools["ls"]
+    assert json.loads(result) == {"show": rows}
 
-    # Test timeout case
-    result = list_tool(resource_type=["model", "snapshot"])
-    assert "Timeout: dbt command took too long to complete" in result
-    assert "Try using a specific selector to narrow down the results" in result
 
-    # Test with selector - should still timeout
-    result = list_tool(selector="my_model", resource_type=["model"])
-    assert "Timeout: dbt command took too long to complete" in result
-    assert "Try using a specific selector to narrow down the results" in result
+@pytest.mark.asyncio
+async def test_dbt_commands_limited_by_max_concurrency(
+    monkeypatch: MonkeyPatch, mock_fastmcp
+):
+    running = 0
+    max_running = 0
+
+    class MockSlowProcess(MockProcess):
+        async def wait(self):
+            nonlocal running
+            await asyncio.sleep(0.01)
+            running -= 1
+            return await super().wait()
+
+    async def mock_exec(*args, **kwargs):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        return MockSlowProcess([b"command output"])
+
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", mock_exec)
+
+    fastmcp, tools = mock_fastmcp
+    register_dbt_cli_tools(
+        fastmcp, replace(mock_dbt_cli_config, dbt_cli_max_concurrency=2)
+    )
+
+    results = await asyncio.gather(*(tools["run"]() for _ in range(5)))
+
+    assert results == ["command output"] * 5
+    assert max_running == 2
+
+
+@pytest.mark.asyncio
+async def test_list_command_times_out_waiting_for_slot(
+    monkeypatch: MonkeyPatch, mock_fastmcp
+):
+    build_started = asyncio.Event()
+
+    class HangingStream:
+        async def read(self, n=-1):
+            build_started.set()
+            await asyncio.Event().wait()
+
+    class MockHangingProcess(MockProcess):
+        pid = 4242
+
+        def __init__(self):
+            super().__init__([])
+            self.stdout = HangingStream()
+
+    async def mock_exec(*args, **kwargs):
+        return MockHangingProcess()
+
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", mock_exec)
+    monkeypatch.setattr(os, "killpg", lambda pid, sig: None)
+
+    fastmcp, tools = mock_fastmcp
+    register_dbt_cli_tools(
+        fastmcp,
+        replace(mock_dbt_cli_config, dbt_cli_timeout=0, dbt_cli_max_concurrency=1),
+    )
+
+    # The build holds the only slot until it's cancelled
+    build = asyncio.create_task(tools["build"]())
+    await build_started.wait()
+    result = await tools["ls"]()
+    build.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await build
+
+    assert result == (
+        "Timeout: waiting for another dbt command to finish."
+        " Try again once it has completed."
+    )
+
+
+def test_excluded_tools_not_registered(mock_fastmcp):
+    fastmcp, tools = mock_fastmcp
+    register_dbt_cli_tools(fastmcp, mock_dbt_cli_config, exclude_tools=["list", "show"])
+
+    assert "ls" not in tools
+    assert "show" not in tools
+    assert "run" in tools
+
+
+@pytest.mark.asyncio
+async def test_tools_keep_structured_output():
+    fastmcp = FastMCP("test")
+    register_dbt_cli_tools(fastmcp, mock_dbt_cli_config)
+
+    tools = await fastmcp.list_tools()
+
+    assert tools
+    assert all(tool.outputSchema is not None for tool in tools)